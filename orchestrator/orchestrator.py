@@ -8,13 +8,14 @@ import asyncio
 import json
 import logging
 import os
+import signal
 import subprocess
 import sys
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 import shutil
 
 # Configure logging
@@ -36,6 +37,7 @@ class TaskStatus(Enum):
     COMPLETED = "completed"
     FAILED = "failed"
     BLOCKED = "blocked"
+    CANCELLED = "cancelled"
 
 
 class AgentStatus(Enum):
@@ -55,6 +57,7 @@ class Task:
     prompt: str
     branch_name: str
     dependencies: List[str] = None
+    priority: int = 0
     status: TaskStatus = TaskStatus.PENDING
     agent_id: Optional[str] = None
     start_time: Optional[datetime] = None
@@ -85,24 +88,39 @@ class Agent:
 class TaskOrchestrator:
     """Orchestrates multiple Claude Code agents working on different tasks"""
 
-    def __init__(self, project_root: Path, max_parallel_agents: int = 3):
+    def __init__(self, project_root: Path, max_parallel_agents: int = 3, preemption: bool = False):
         self.project_root = Path(project_root)
         self.max_parallel_agents = max_parallel_agents
+        self.preemption = preemption
         self.tasks: Dict[str, Task] = {}
         self.agents: Dict[str, Agent] = {}
         self.task_queue: List[str] = []
         self.completed_tasks: List[str] = []
+        self.running: Dict[str, asyncio.Task] = {}
+        self.preempted: Set[str] = set()
+        self.cancel_requested = False
         self.state_file = self.project_root / "orchestrator/state.json"
 
         logger.info(f"Initialized orchestrator for project: {project_root}")
         logger.info(f"Max parallel agents: {max_parallel_agents}")
+        logger.info(f"Preemption: {'enabled' if preemption else 'disabled'}")
 
     def add_task(self, task: Task):
         """Add a task to the orchestrator"""
         self.tasks[task.id] = task
         if task.status == TaskStatus.PENDING:
-            self.task_queue.append(task.id)
-        logger.info(f"Added task: {task.id} - {task.name}")
+            self.enqueue_task(task.id)
+        logger.info(f"Added task: {task.id} - {task.name} (priority {task.priority})")
+
+    def enqueue_task(self, task_id: str):
+        """Insert a task into the queue, keeping higher priorities first"""
+        priority = self.tasks[task_id].priority
+        index = len(self.task_queue)
+        for i, queued_id in enumerate(self.task_queue):
+            if self.tasks[queued_id].priority < priority:
+                index = i
+                break
+        self.task_queue.insert(index, task_id)
 
     def create_agent(self, agent_id: str, name: str) -> Agent:
         """Create a new agent"""
@@ -146,6 +164,7 @@ class TaskOrchestrator:
             task.status = TaskStatus.IN_PROGRESS
             task.agent_id = agent.id
             task.start_time = datetime.now()
+            task.end_time = None
             agent.status = AgentStatus.WORKING
             agent.current_task = task
 
@@ -172,25 +191,39 @@ class TaskOrchestrator:
             # Run Claude Code
             result = await self.run_command(claude_cmd, timeout=1800)  # 30 min timeout
 
+            # The agent run is over; end_time marks it as no longer preemptible
+            task.end_time = datetime.now()
+
             if result.returncode == 0:
-                # Task completed successfully
+                # Get modified files
+                git_status = await self.run_git_command(["git", "status", "--short"])
+                task.files_modified = git_status.stdout.strip().split('\n') if git_status.stdout else []
+
+                # Task completed successfully; no awaits below, so it cannot be cancelled halfway
                 task.status = TaskStatus.COMPLETED
-                task.end_time = datetime.now()
                 task.result = "Completed successfully"
                 self.completed_tasks.append(task.id)
                 agent.tasks_completed += 1
                 logger.info(f"Task {task.id} completed successfully by agent {agent.id}")
 
-                # Get modified files
-                git_status = await self.run_git_command(["git", "status", "--short"])
-                task.files_modified = git_status.stdout.strip().split('\n') if git_status.stdout else []
-
             else:
                 task.status = TaskStatus.FAILED
-                task.end_time = datetime.now()
                 task.error = result.stderr or "Unknown error"
                 logger.error(f"Task {task.id} failed: {task.error}")
 
+        except asyncio.CancelledError:
+            task.end_time = datetime.now()
+            if task.id in self.preempted:
+                # Preempted by a higher-priority task; finish_task requeues it
+                task.status = TaskStatus.PENDING
+                task.agent_id = None
+                logger.info(f"Task {task.id} preempted on agent {agent.id}")
+            else:
+                task.status = TaskStatus.CANCELLED
+                task.error = task.error or "Cancelled"
+                logger.info(f"Task {task.id} cancelled on agent {agent.id}")
+            raise
+
         except Exception as e:
             task.status = TaskStatus.FAILED
             task.end_time = datetime.now()
@@ -207,11 +240,13 @@ class TaskOrchestrator:
         """Run a command asynchronously"""
         logger.debug(f"Running command: {' '.join(cmd)}")
 
+        # Run in its own session so the whole process tree can be signalled
         process = await asyncio.create_subprocess_exec(
             *cmd,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
-            cwd=self.project_root
+            cwd=self.project_root,
+            start_new_session=True
         )
 
         try:
@@ -223,43 +258,197 @@ class TaskOrchestrator:
                 cmd, process.returncode, stdout.decode(), stderr.decode()
             )
         except asyncio.TimeoutError:
-            process.kill()
+            await self.stop_process_tree(process)
             raise Exception(f"Command timed out after {timeout}s")
+        except asyncio.CancelledError:
+            await self.stop_process_tree(process)
+            raise
+
+    async def stop_process_tree(self, process: asyncio.subprocess.Process):
+        """
+        Terminate a process tree and wait for it to exit, even if cancelled again
+
+        Repeated cancels are held back until the tree is gone, so the caller
+        never releases its agent while the process is still running.
+        """
+        termination = asyncio.ensure_future(self.terminate_process_tree(process))
+        cancelled = False
+        while not termination.done():
+            try:
+                await asyncio.shield(termination)
+            except asyncio.CancelledError:
+                cancelled = True
+
+        termination.result()
+        if cancelled:
+            raise asyncio.CancelledError
+
+    async def terminate_process_tree(self, process: asyncio.subprocess.Process, grace_period: int = 10):
+        """Stop a process and its children, escalating from SIGTERM to SIGKILL"""
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+        try:
+            await asyncio.wait_for(process.wait(), timeout=grace_period)
+        except asyncio.TimeoutError:
+            logger.warning(f"Process {process.pid} ignored SIGTERM, sending SIGKILL")
+
+        # Children can outlive the group leader, so always sweep the whole group
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
 
     async def run_git_command(self, cmd: List[str]) -> subprocess.CompletedProcess:
         """Run a git command"""
         return await self.run_command(cmd)
 
+    def start_task(self, agent: Agent, task: Task):
+        """Run a task on an agent without blocking the orchestration loop"""
+        # Claim the agent now so the same loop pass does not hand it out twice
+        agent.status = AgentStatus.WORKING
+        agent.current_task = task
+        running = asyncio.create_task(self.execute_task_with_claude(agent, task))
+        self.running[task.id] = running
+        running.add_done_callback(lambda done: self.finish_task(agent, task, done))
+
+    def finish_task(self, agent: Agent, task: Task, done: asyncio.Task):
+        """Release bookkeeping once a task's coroutine has exited"""
+        # Only drop our own handle, never that of a later run of the same task
+        if self.running.get(task.id) is done:
+            del self.running[task.id]
+
+        # execute_task_with_claude clears current_task on exit, so if it still
+        # points at this task the coroutine was cancelled before its first step
+        if agent.current_task is task:
+            agent.status = AgentStatus.IDLE
+            agent.current_task = None
+
+        # Still pending means the run was preempted or never got to start.
+        # Requeue here, after the handle is gone, so a restart gets a fresh one.
+        if task.status == TaskStatus.PENDING:
+            if task.id in self.preempted:
+                self.preempted.discard(task.id)
+                self.enqueue_task(task.id)
+                logger.info(f"Task {task.id} requeued after preemption")
+            else:
+                task.status = TaskStatus.CANCELLED
+                task.end_time = datetime.now()
+
+    def preempt_for(self, task: Task) -> bool:
+        """Requeue the lowest-priority running task if it ranks below the given task"""
+        # Wait for an in-flight preemption to release its agent first
+        if any(task_id in self.running for task_id in self.preempted):
+            return False
+
+        # Only tasks still inside their agent run; finished runs are never repeated
+        candidates = [
+            self.tasks[task_id] for task_id in self.running
+            if self.tasks[task_id].status == TaskStatus.IN_PROGRESS
+            and self.tasks[task_id].end_time is None
+        ]
+        if not candidates:
+            return False
+
+        # Among equal priorities, restart the newest run since it has done the least work
+        victim = min(candidates, key=lambda t: (t.priority, -t.start_time.timestamp()))
+        if victim.priority >= task.priority:
+            return False
+
+        logger.info(
+            f"Preempting task {victim.id} (priority {victim.priority}) "
+            f"for task {task.id} (priority {task.priority})"
+        )
+        self.preempted.add(victim.id)
+        self.running[victim.id].cancel()
+        return True
+
+    async def cancel_task(self, task_id: str, reason: str = "Cancelled by request") -> List[str]:
+        """
+        Cancel a task and every task that depends on it
+
+        Pending tasks are dropped from the queue; running tasks have their
+        process tree terminated. Returns the ids of all cancelled tasks.
+        """
+        task = self.tasks[task_id]
+        if task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED):
+            return []
+
+        self.preempted.discard(task_id)
+
+        if task_id in self.task_queue:
+            self.task_queue.remove(task_id)
+
+        running = self.running.get(task_id)
+        if running is not None:
+            running.cancel()
+            await asyncio.gather(running, return_exceptions=True)
+        else:
+            task.status = TaskStatus.CANCELLED
+            task.end_time = datetime.now()
+            logger.info(f"Task {task_id} cancelled before starting")
+
+        # The task may have finished before the cancel reached it
+        if task.status != TaskStatus.CANCELLED:
+            return []
+
+        cancelled = [task_id]
+        task.error = reason
+
+        # Cascade to dependents, which can no longer have their dependencies met
+        for dependent in list(self.tasks.values()):
+            if task_id in dependent.dependencies:
+                cancelled += await self.cancel_task(
+                    dependent.id, f"Cancelled: dependency {task_id} was cancelled"
+                )
+
+        self.save_state()
+        return cancelled
+
+    async def cancel_all(self, reason: str = "Session cancelled") -> List[str]:
+        """Cancel every outstanding task and stop the orchestration loop"""
+        self.cancel_requested = True
+
+        # Cancel everything up front so the termination grace periods overlap
+        results = await asyncio.gather(*[
+            self.cancel_task(task_id, reason)
+            for task_id in list(self.task_queue) + list(self.running)
+        ])
+        return list(dict.fromkeys(task_id for ids in results for task_id in ids))
+
     async def orchestrate(self):
         """Main orchestration loop"""
         logger.info("Starting orchestration")
 
-        while self.task_queue or any(a.status == AgentStatus.WORKING for a in self.agents.values()):
-            # Start new tasks if agents are available
-            tasks_to_start = []
+        while self.task_queue or self.running:
+            if self.cancel_requested:
+                break
 
+            # Start new tasks if agents are available; the queue is priority ordered
             for task_id in list(self.task_queue):
                 if not self.can_start_task(task_id):
                     continue
 
                 agent = self.get_available_agent()
                 if agent is None:
+                    # Free a slot for next pass; the requeued task lands behind this one
+                    if self.preemption:
+                        self.preempt_for(self.tasks[task_id])
                     break
 
                 task = self.tasks[task_id]
                 self.task_queue.remove(task_id)
-                tasks_to_start.append((agent, task))
-
-            # Execute tasks in parallel
-            if tasks_to_start:
-                await asyncio.gather(*[
-                    self.execute_task_with_claude(agent, task)
-                    for agent, task in tasks_to_start
-                ])
+                self.start_task(agent, task)
 
             # Short sleep to avoid busy waiting
             await asyncio.sleep(1)
 
+        if self.running:
+            await asyncio.gather(*self.running.values(), return_exceptions=True)
+
         logger.info("Orchestration complete")
         self.print_summary()
 
@@ -322,10 +511,12 @@ class TaskOrchestrator:
         total_tasks = len(self.tasks)
         completed = len([t for t in self.tasks.values() if t.status == TaskStatus.COMPLETED])
         failed = len([t for t in self.tasks.values() if t.status == TaskStatus.FAILED])
+        cancelled = len([t for t in self.tasks.values() if t.status == TaskStatus.CANCELLED])
 
         print(f"\nTotal Tasks: {total_tasks}")
         print(f"Completed: {completed}")
         print(f"Failed: {failed}")
+        print(f"Cancelled: {cancelled}")
         print(f"Success Rate: {(completed/total_tasks*100):.1f}%\n")
 
         print("Task Details:")
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Tests for task scheduling, cancellation and preemption
+Agent runs are stubbed out, so no git or claude-code processes are started
+"""
+
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# orchestrator.py opens orchestrator/logs/orchestrator.log relative to the cwd on import
+_log_root = tempfile.mkdtemp()
+os.makedirs(os.path.join(_log_root, "orchestrator", "logs"))
+_cwd = os.getcwd()
+os.chdir(_log_root)
+try:
+    from orchestrator import AgentStatus, Task, TaskOrchestrator, TaskStatus
+finally:
+    os.chdir(_cwd)
+
+
+class StubOrchestrator(TaskOrchestrator):
+    """Orchestrator whose agent runs sleep instead of running claude-code"""
+
+    def __init__(self, *args, run_time: float = 0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.run_time = run_time
+        self.agent_runs: list = []
+
+    async def run_command(self, cmd, timeout=300):
+        if cmd[0] == "claude-code":
+            self.agent_runs.append(cmd[2])
+            await asyncio.sleep(self.run_time)
+        return subprocess.CompletedProcess(cmd, 0, "", "")
+
+
+def make_task(task_id: str, dependencies=None, priority: int = 0) -> Task:
+    # The prompt doubles as the task id so agent_runs records which task ran
+    return Task(
+        id=task_id,
+        name=task_id,
+        description=task_id,
+        prompt=task_id,
+        branch_name=f"feature/{task_id}",
+        dependencies=dependencies or [],
+        priority=priority
+    )
+
+
+class TaskOrchestratorTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.project_root = tempfile.mkdtemp()
+
+    def make_orchestrator(self, **kwargs) -> StubOrchestrator:
+        return StubOrchestrator(self.project_root, **kwargs)
+
+    async def wait_until_running(self, orchestrator: TaskOrchestrator, task_id: str):
+        while orchestrator.tasks[task_id].status != TaskStatus.IN_PROGRESS:
+            await asyncio.sleep(0.01)
+
+    def test_queue_is_priority_ordered(self):
+        orchestrator = self.make_orchestrator()
+        orchestrator.add_task(make_task("low"))
+        orchestrator.add_task(make_task("high", priority=5))
+        orchestrator.add_task(make_task("mid", priority=1))
+        orchestrator.add_task(make_task("low-2"))
+
+        self.assertEqual(orchestrator.task_queue, ["high", "mid", "low", "low-2"])
+
+    async def test_cancel_pending_task_cascades_to_dependents(self):
+        orchestrator = self.make_orchestrator()
+        orchestrator.add_task(make_task("a"))
+        orchestrator.add_task(make_task("b", dependencies=["a"]))
+        orchestrator.add_task(make_task("c", dependencies=["b"]))
+        orchestrator.add_task(make_task("d"))
+
+        cancelled = await orchestrator.cancel_task("a")
+
+        self.assertEqual(cancelled, ["a", "b", "c"])
+        self.assertEqual(orchestrator.task_queue, ["d"])
+        self.assertEqual(orchestrator.tasks["d"].status, TaskStatus.PENDING)
+        self.assertEqual(orchestrator.tasks["c"].error, "Cancelled: dependency b was cancelled")
+
+    async def test_cancel_running_task_cascades_and_frees_agent(self):
+        orchestrator = self.make_orchestrator(run_time=30)
+        orchestrator.add_task(make_task("a"))
+        orchestrator.add_task(make_task("b", dependencies=["a"]))
+        run = asyncio.create_task(orchestrator.orchestrate())
+        await self.wait_until_running(orchestrator, "a")
+
+        cancelled = await orchestrator.cancel_task("a")
+        await asyncio.wait_for(run, timeout=5)
+
+        self.assertEqual(cancelled, ["a", "b"])
+        self.assertEqual(orchestrator.tasks["a"].status, TaskStatus.CANCELLED)
+        self.assertEqual(orchestrator.completed_tasks, [])
+        self.assertTrue(all(a.status == AgentStatus.IDLE for a in orchestrator.agents.values()))
+
+    async def test_cancel_before_start(self):
+        orchestrator = self.make_orchestrator()
+        task = make_task("a")
+        orchestrator.add_task(task)
+        orchestrator.task_queue.remove("a")
+        agent = orchestrator.get_available_agent()
+
+        orchestrator.start_task(agent, task)
+        cancelled = await orchestrator.cancel_task("a")
+
+        self.assertEqual(cancelled, ["a"])
+        self.assertEqual(task.status, TaskStatus.CANCELLED)
+        self.assertEqual(agent.status, AgentStatus.IDLE)
+        self.assertIsNone(agent.current_task)
+        self.assertEqual(orchestrator.agent_runs, [])
+
+    async def test_cancel_finished_task_does_not_cascade(self):
+        orchestrator = self.make_orchestrator(run_time=0)
+        orchestrator.add_task(make_task("a"))
+        orchestrator.add_task(make_task("b", dependencies=["a"]))
+        orchestrator.task_queue.remove("a")
+        orchestrator.start_task(orchestrator.get_available_agent(), orchestrator.tasks["a"])
+        await asyncio.gather(orchestrator.running["a"])
+
+        self.assertEqual(await orchestrator.cancel_task("a"), [])
+        self.assertEqual(orchestrator.tasks["a"].status, TaskStatus.COMPLETED)
+        self.assertEqual(orchestrator.tasks["b"].status, TaskStatus.PENDING)
+
+    async def test_finish_does_not_release_reused_agent(self):
+        orchestrator = self.make_orchestrator()
+        first, second = make_task("a"), make_task("b")
+        agent = orchestrator.get_available_agent()
+        first.status = TaskStatus.COMPLETED
+
+        # The agent already moved on before the first task's done callback ran
+        agent.status = AgentStatus.WORKING
+        agent.current_task = second
+        orchestrator.finish_task(agent, first, asyncio.Future())
+
+        self.assertEqual(first.status, TaskStatus.COMPLETED)
+        self.assertEqual(agent.status, AgentStatus.WORKING)
+        self.assertIs(agent.current_task, second)
+
+    async def test_preempted_task_is_requeued(self):
+        orchestrator = self.make_orchestrator(max_parallel_agents=1, preemption=True, run_time=2)
+        orchestrator.add_task(make_task("low"))
+        run = asyncio.create_task(orchestrator.orchestrate())
+        await self.wait_until_running(orchestrator, "low")
+
+        orchestrator.add_task(make_task("high", priority=5))
+        await asyncio.wait_for(run, timeout=15)
+
+        self.assertEqual(orchestrator.agent_runs, ["low", "high", "low"])
+        self.assertEqual(orchestrator.completed_tasks, ["high", "low"])
+        self.assertEqual(orchestrator.tasks["low"].status, TaskStatus.COMPLETED)
+
+    async def test_preempted_coroutine_leaves_requeue_to_done_callback(self):
+        orchestrator = self.make_orchestrator(run_time=30)
+        task = make_task("low")
+        orchestrator.add_task(task)
+        orchestrator.task_queue.remove("low")
+        agent = orchestrator.get_available_agent()
+
+        # Run the coroutine without start_task so its done callback never fires
+        run = asyncio.create_task(orchestrator.execute_task_with_claude(agent, task))
+        await self.wait_until_running(orchestrator, "low")
+        orchestrator.preempted.add("low")
+        run.cancel()
+        await asyncio.gather(run, return_exceptions=True)
+
+        self.assertEqual(task.status, TaskStatus.PENDING)
+        self.assertEqual(orchestrator.task_queue, [])
+
+        orchestrator.finish_task(agent, task, run)
+        self.assertEqual(orchestrator.task_queue, ["low"])
+        self.assertNotIn("low", orchestrator.preempted)
+
+    async def test_stale_done_callback_keeps_restarted_run(self):
+        orchestrator = self.make_orchestrator(max_parallel_agents=2, run_time=30)
+        task = make_task("low")
+        orchestrator.add_task(task)
+        orchestrator.task_queue.remove("low")
+        first_agent = orchestrator.get_available_agent()
+        orchestrator.start_task(first_agent, task)
+        first_run = orchestrator.running["low"]
+        await self.wait_until_running(orchestrator, "low")
+
+        # Restart the task on another agent before the first run's callback fires,
+        # from the state a preempted run leaves behind
+        task.status = TaskStatus.PENDING
+        second_agent = orchestrator.get_available_agent()
+        orchestrator.start_task(second_agent, task)
+        second_run = orchestrator.running["low"]
+        await self.wait_until_running(orchestrator, "low")
+        orchestrator.finish_task(first_agent, task, first_run)
+
+        self.assertIs(orchestrator.running["low"], second_run)
+        self.assertEqual(await orchestrator.cancel_task("low"), ["low"])
+        self.assertTrue(second_run.done())
+        self.assertEqual(second_agent.status, AgentStatus.IDLE)
+        first_run.cancel()
+        await asyncio.gather(first_run, return_exceptions=True)
+
+    async def test_preemption_picks_newest_run_among_equal_priorities(self):
+        orchestrator = self.make_orchestrator(max_parallel_agents=2, preemption=True, run_time=30)
+        for task_id in ("older", "newer"):
+            orchestrator.add_task(make_task(task_id))
+            orchestrator.task_queue.remove(task_id)
+            orchestrator.start_task(orchestrator.get_available_agent(), orchestrator.tasks[task_id])
+            await self.wait_until_running(orchestrator, task_id)
+            await asyncio.sleep(0.01)
+
+        self.assertTrue(orchestrator.preempt_for(make_task("high", priority=5)))
+        self.assertEqual(orchestrator.preempted, {"newer"})
+        await orchestrator.cancel_all()
+
+    async def test_preemption_ignores_lower_or_equal_priority(self):
+        orchestrator = self.make_orchestrator(max_parallel_agents=1, preemption=True, run_time=30)
+        orchestrator.add_task(make_task("running", priority=1))
+        orchestrator.task_queue.remove("running")
+        orchestrator.start_task(orchestrator.get_available_agent(), orchestrator.tasks["running"])
+        await self.wait_until_running(orchestrator, "running")
+
+        self.assertFalse(orchestrator.preempt_for(make_task("same", priority=1)))
+        await orchestrator.cancel_all()
+
+    async def test_preemption_skips_finished_agent_run(self):
+        orchestrator = self.make_orchestrator(max_parallel_agents=1, preemption=True, run_time=0)
+        release = asyncio.Event()
+
+        async def slow_git_status(cmd):
+            if cmd[1] == "status":
+                await release.wait()
+            return subprocess.CompletedProcess(cmd, 0, "", "")
+
+        orchestrator.run_git_command = slow_git_status
+        orchestrator.add_task(make_task("low"))
+        orchestrator.task_queue.remove("low")
+        orchestrator.start_task(orchestrator.get_available_agent(), orchestrator.tasks["low"])
+        while not orchestrator.agent_runs:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+
+        self.assertFalse(orchestrator.preempt_for(make_task("high", priority=5)))
+        release.set()
+        await asyncio.gather(orchestrator.running["low"])
+        self.assertEqual(orchestrator.completed_tasks, ["low"])
+
+    async def test_cancel_session(self):
+        orchestrator = self.make_orchestrator(max_parallel_agents=2, run_time=30)
+        orchestrator.add_task(make_task("a"))
+        orchestrator.add_task(make_task("b"))
+        orchestrator.add_task(make_task("c", dependencies=["a"]))
+        orchestrator.add_task(make_task("d"))
+        run = asyncio.create_task(orchestrator.orchestrate())
+        await self.wait_until_running(orchestrator, "a")
+        await self.wait_until_running(orchestrator, "b")
+
+        cancelled = await orchestrator.cancel_all()
+        await asyncio.wait_for(run, timeout=5)
+
+        self.assertEqual(sorted(cancelled), ["a", "b", "c", "d"])
+        self.assertTrue(all(t.status == TaskStatus.CANCELLED for t in orchestrator.tasks.values()))
+        self.assertEqual(orchestrator.running, {})
+        self.assertEqual(orchestrator.task_queue, [])
+
+
+class TerminateProcessTreeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_second_cancel_still_kills_process_tree(self):
+        orchestrator = TaskOrchestrator(tempfile.mkdtemp())
+        orchestrator_terminate = orchestrator.terminate_process_tree
+        orchestrator.terminate_process_tree = lambda process: orchestrator_terminate(process, grace_period=0.5)
+        started = []
+
+        original_exec = asyncio.create_subprocess_exec
+
+        async def recording_exec(*args, **kwargs):
+            process = await original_exec(*args, **kwargs)
+            started.append(process)
+            return process
+
+        asyncio.create_subprocess_exec = recording_exec
+        try:
+            run = asyncio.create_task(
+                orchestrator.run_command(["sh", "-c", "trap '' TERM; sleep 30; true"])
+            )
+            await asyncio.sleep(0.3)
+            run.cancel()
+            await asyncio.sleep(0.1)
+            run.cancel()
+            await asyncio.gather(run, return_exceptions=True)
+        finally:
+            asyncio.create_subprocess_exec = original_exec
+
+        # The command must not return until the tree is gone, or its agent slot
+        # would be released early. The leader ignores SIGTERM, so it only exits
+        # if SIGKILL was still sent.
+        self.assertTrue(run.cancelled())
+        self.assertEqual(started[0].returncode, -signal.SIGKILL)
+
+
+if __name__ == "__main__":
+    unittest.main()